@@ -1,15 +1,44 @@
-import bs4
 import re
-import inspect
+import functools
+import lxml.html
+from lxml import etree
 import pandas as pd
-import numpy as np
 import parsing
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
 from abc import ABCMeta, abstractmethod
 from selenium import webdriver
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait as wait
 
+_transaction_state = threading.local()
+_RE_NON_DIGITS = re.compile('[^0-9]')
+_RE_STR_EXCESS = re.compile('[^а-яА-Яa-zA-Z0-9+:/@.,(-) ]')
+_RE_COL_NAME_EXCESS = re.compile('[^а-яА-Яa-zA-Z0-9_ ]')
+_RE_SPACES = re.compile(r'\s+')
+_RE_STR_DIRTY = re.compile('[^а-яА-Яa-zA-Z0-9+:/@.,(-) ]|  |^ | $')
+_HTML_PARSER = lxml.html.HTMLParser(remove_comments=True)
+_ORDER_GOODS_CONTAINER = 'positionKTRU'
+_CONTRACT_GOODS_CONTAINER = 'contractSubjects'
+_WAIT_POLL_FREQUENCY = 0.1
+_NEXT_PAGE_BUTTON_SELECTOR = "a[class='paginator-button paginator-button-next']"
+_JS_CONTAINER_PAGE = "var element = document.getElementById(arguments[0]); " \
+                     "if (!element || element.className !== 'container') return null; " \
+                     "var pages = 0; " \
+                     "document.querySelectorAll(\"ul[class*='paginator'] li, .paginator-button\").forEach(" \
+                     "function (item) { var number = parseInt(item.textContent, 10); " \
+                     "if (number > pages) pages = number; }); " \
+                     "return [element.innerHTML, document.querySelector(arguments[1]) !== null, pages];"
+_XPATH_BLOCKS = etree.XPath("//div[@class='row blockInfo']/div")
+_XPATH_HEADER_CELLS = etree.XPath('.//td | .//th')
+_XPATH_ROWS = etree.XPath('.//tr')
+_XPATH_CELLS = etree.XPath('.//td')
+_XPATH_PAIRED_SECTIONS = etree.XPath('.//section[count(.//span) = 2]')
+_XPATH_SPANS = etree.XPath('.//span')
+
 
 class StorageAdapter:
     """
@@ -71,7 +100,7 @@ class StorageAdapter:
         :type url:  str
 
         :param page: parsing content.
-        :type page: str like or some bs4/selenium parsing elements
+        :type page: str like or some lxml/selenium parsing elements
 
         :param func: information about function caught an exception.
         :type func: FrameInfo
@@ -107,6 +136,15 @@ class StorageAdapter:
         self._data_id = new_id
         return self
 
+    def flush(self):
+        """Write all buffered data to the outer storage"""
+        pass
+
+    @contextmanager
+    def transaction(self):
+        """Group all writes of one parsed page. The storage may save them when the page is finished."""
+        yield self
+
 
 class StorageAdapterDataframe(StorageAdapter):
     """
@@ -115,12 +153,15 @@ class StorageAdapterDataframe(StorageAdapter):
     :param _data_labels: dictionary with parsed data.
     :type _data_labels: dict
 
+    :param _error_rows: collected errors. They are turned into the 'errors' dataframe by get_data().
+    :type _error_rows: list
+
     """
 
     def __init__(self):
         super().__init__()
-        self._data_labels = {'main': pd.DataFrame([[self._data_id]], columns=['id']),
-                             'errors': pd.DataFrame(None, columns=['URL', 'parser', 'function', 'exception'])}
+        self._data_labels = {'main': pd.DataFrame([[self._data_id]], columns=['id'])}
+        self._error_rows = []
 
     def add_table(self, label: str, n: int, data):
         data['id'] = self._data_id
@@ -129,26 +170,33 @@ class StorageAdapterDataframe(StorageAdapter):
 
     def add_main_data(self, label: str, data):
         if isinstance(data, dict):
-            cols = [label + '~' + one_key for one_key in data.keys()]
-            self._data_labels['main'] = pd.concat(
-                [self._data_labels['main'], pd.DataFrame([data.values()], columns=cols)], axis=1)
+            main = self._data_labels['main']
+            for one_key, value in data.items():
+                main.insert(len(main.columns), label + '~' + one_key, value, allow_duplicates=True)
         else:
             self._data_labels['main'][label] = data
 
     def add_error_data(self, url, page, func, err):
-        self._data_labels['errors'].loc[len(self._data_labels['errors'])] = [url, page, func, err]
+        self._error_rows.append((url, page, func, err))
 
     def roll_data(self):
-        for one_element in self._data_labels.items():
-            self._data_labels[one_element[0]] = one_element[1].groupby(level=0,
-                                                                       axis=1).apply(lambda x: x.apply(join_for_columns,
-                                                                                                       axis=1))
+        for label, data in self._data_labels.items():
+            if data.columns.is_unique:
+                continue
+            positions = {}
+            for i, col in enumerate(data.columns):
+                positions.setdefault(col, []).append(i)
+            values = data.to_numpy()
+            self._data_labels[label] = pd.DataFrame({col: values[:, pos[0]] if len(pos) == 1
+                                                     else [join_for_columns(row) for row in values[:, pos]]
+                                                     for col, pos in positions.items()}, index=data.index)
 
     def create_child_storage(self):
         return StorageAdapterDataframe()
 
     def get_data(self):
-        return self._data_labels
+        return {**self._data_labels,
+                'errors': pd.DataFrame(self._error_rows, columns=['URL', 'parser', 'function', 'exception'])}
 
     def set_identifiers(self, new_id, *args):
         super().set_identifiers(new_id)
@@ -170,43 +218,89 @@ class StorageAdapterSQLite(StorageAdapter):
       :param _cursor: dictionary with parsed data.
       :type _cursor: sqlite3.Cursor
 
-      ..note:: This application doesn't use multithreading and all steps goes one-by-one,
-      so it's faster to use one connection and one cursor for all counting.
+      :param batch_size: number of changed rows collected in one transaction before commit.
+      :type batch_size: int
+
+      :param _commit_state: number of connection's changes at the last commit. It's shared by all storages
+      of the connection, so changes of all parsed pages are counted together.
+      :type _commit_state: dict
+
+      :param _schema: names of existing tables with sets of their columns. Columns are loaded on the first request.
+      Storages working with the same connection share one schema.
+      :type _schema: dict
+
+      :param _statements: SQL strings built for tables and sets of their columns. It's shared like the schema.
+      :type _statements: dict
+
+      :param _seen_ids: ids of records in the main tables. Ids are loaded on the first request to the table
+      and shared like the schema. They are checked and reserved under the lock of the connection.
+      :type _seen_ids: dict
+
+      :param _lock: lock of the connection shared like the schema.
+      :type _lock: threading.RLock
+
+      ..note:: It's faster to use one connection for all counting. Parsing threads share the connection
+      and every thread works through its own cursor.
+      Every commit forces SQLite to sync the database file, so rows are committed by batches
+      when a page transaction ends and the rest of them must be written with flush() at the end of work.
+      Pages are parsed by threads in parallel, writes of a page are buffered by its outer transaction.
+      When the page is finished they are replayed in a savepoint under the lock, so a commit never takes
+      a half-written page and a failed page is rolled back. Ids of the page are reserved at once, so a record
+      parsed by several threads is written only once.
       """
 
-    def __init__(self, db_connection: sqlite3.Connection, cursor: sqlite3.Cursor):
+    def __init__(self, db_connection: sqlite3.Connection, cursor: sqlite3.Cursor, batch_size: int = 10000,
+                 schema: dict = None, statements: dict = None, seen_ids: dict = None, commit_state: dict = None,
+                 lock: threading.RLock = None):
         super().__init__()
         self.db_connection = db_connection
         self._main_table = 'main'
         self._cursor = cursor
+        self.batch_size = batch_size
+        self._commit_state = commit_state if commit_state is not None \
+            else {'committed_changes': db_connection.total_changes}
+        self._schema = schema if schema is not None else {}
+        self._statements = statements if statements is not None else {}
+        self._seen_ids = seen_ids if seen_ids is not None else {}
+        self._lock = lock if lock is not None else threading.RLock()
 
     def add_table(self, label, n, data):
         if len(data) != 0:
-            table = preprocess_col_names(label)
-            if not self._check_table_existion(table):
-                self._create_table(table)
-            self._add_rows(table, data)
+            self._write(self._add_table, preprocess_col_names(label), data)
 
     def add_main_data(self, label, data):
         if len(data) != 0:
-            self._add_rows(self._main_table, data, column_name=label)
+            self._write(self._add_rows, self._main_table, data, 'id', label)
 
     def add_error_data(self, url, page, func, err):
-        if not self._check_table_existion('errs'):
-            self._create_table('errs')
-        self._add_rows('errs', pd.DataFrame([[url, preprocess_str(page),
-                                              func, preprocess_str(err)]],
-                                            columns=['URL', 'parser', 'function', 'exception']))
+        self._write(self._add_error_rows, pd.DataFrame([[url, preprocess_str(page),
+                                                         func, preprocess_str(err)]],
+                                                       columns=['URL', 'parser', 'function', 'exception']))
+
+    def add_parsed_url(self, url: str):
+        """
+        Mark the url as parsed. The mark is written in the same page transaction as the data of the url.
+
+        :param url: url of the parsed page.
+        :type url: str
+        """
+        self._write(self._add_parsed_url, url)
 
     def roll_data(self):
         pass
 
     def create_child_storage(self):
-        return StorageAdapterSQLite(self.db_connection, self._cursor)
+        return StorageAdapterSQLite(self.db_connection, self._cursor, self.batch_size, self._schema,
+                                    self._statements, self._seen_ids, self._commit_state, self._lock)
 
     def get_data(self):
         pass
 
+    def flush(self):
+        with self._lock:
+            self.db_connection.commit()
+            self._commit_state['committed_changes'] = self.db_connection.total_changes
+
     def set_identifiers(self, new_id, data_type: str = ''):
         if len(data_type) == 0:
             raise ValueError('Data must be specified by parser type.')
@@ -215,33 +309,143 @@ class StorageAdapterSQLite(StorageAdapter):
 
         self._main_table = 'main_' + data_type.strip()
         self._data_id = new_id
-        if not self._check_table_existion(self._main_table):
-            self._create_table(self._main_table)
-        self.is_new = not self._check_record_existion(self._main_table, self._data_id)
+        with self._lock:
+            if self._check_table_existion(self._main_table):
+                seen_ids = self._get_seen_ids(self._main_table)
+            else:
+                seen_ids = self._seen_ids.setdefault(self._main_table, set())
+            self.is_new = str(self._data_id) not in seen_ids
+            if self.is_new:
+                seen_ids.add(str(self._data_id))
+                page = self._get_page_writes()
+                if page is not None:
+                    page['ids'].append((self._main_table, str(self._data_id)))
         if self.is_new:
-            self._cursor.execute("INSERT INTO {} (id) values ('{}')".format(self._main_table,
-                                                                            self._data_id))
-            self.db_connection.commit()
+            self._write(self._add_identifier)
         return self
 
-    def _check_table_existion(self, table):
-        return True if len(self._cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='{}';".
-                                                format(table)).fetchall()) > 0 else False
+    @contextmanager
+    def transaction(self):
+        pages = _transaction_state.__dict__.setdefault('pages', {})
+        if id(self._lock) in pages:
+            yield self
+            return
+        page = pages[id(self._lock)] = {'writes': [], 'ids': []}
+        try:
+            try:
+                yield self
+            finally:
+                del pages[id(self._lock)]
+            self._write_page(page['writes'])
+        except BaseException:
+            with self._lock:
+                for table, new_id in page['ids']:
+                    self._seen_ids.get(table, set()).discard(new_id)
+            raise
+
+    def _get_page_writes(self):
+        """Return writes and ids buffered by the page transaction of the current thread or None."""
+        return getattr(_transaction_state, 'pages', {}).get(id(self._lock))
+
+    def _write(self, func, *args):
+        """Run the write at once or buffer it until the page transaction of the current thread is finished.
+        The write keeps the current identifiers of the storage to be replayed with them."""
+        page = self._get_page_writes()
+        if page is None:
+            with self._lock:
+                func(*args)
+        else:
+            page['writes'].append((self, self._main_table, self._data_id, func, args))
+
+    def _write_page(self, writes):
+        """Replay buffered writes of the page in a savepoint. The savepoint is rolled back if any write fails."""
+        with self._lock:
+            if not self.db_connection.in_transaction:
+                self._cursor.execute("BEGIN")
+            self._cursor.execute("SAVEPOINT page")
+            try:
+                for storage, main_table, data_id, func, args in writes:
+                    current_ids = storage._main_table, storage._data_id
+                    storage._main_table, storage._data_id = main_table, data_id
+                    try:
+                        func(*args)
+                    finally:
+                        storage._main_table, storage._data_id = current_ids
+            except BaseException:
+                self._cursor.execute("ROLLBACK TO page")
+                self._cursor.execute("RELEASE page")
+                self._schema.clear()
+                raise
+            self._cursor.execute("RELEASE page")
+            self._commit_if_needed()
+
+    def _add_identifier(self):
+        """Create the main table if needed and insert the record of the current id."""
+        if not self._check_table_existion(self._main_table):
+            self._create_table(self._main_table)
+        self._cursor.execute("INSERT INTO {} (id) values (?)".format(self._main_table), (str(self._data_id),))
 
-    def _check_record_existion(self, table, new_id, column_id='id'):
-        """ Find record specified by id from column_id in the database. """
-        return True if len(self._cursor.execute("SELECT {} FROM {} WHERE {} = '{}';".
-                                                format(column_id, table,
-                                                       column_id, new_id)).fetchall()) > 0 else False
+    def _add_table(self, table, data):
+        if not self._check_table_existion(table):
+            self._create_table(table, [preprocess_col_names(col) for col in data.columns.to_list()])
+        self._add_rows(table, data)
 
-    def _create_table(self, table):
-        """Create table with basic columns. Some specific tables has it's own creation string."""
+    def _add_error_rows(self, data):
+        if not self._check_table_existion('errs'):
+            self._create_table('errs')
+        self._add_rows('errs', data)
+
+    def _add_parsed_url(self, url):
+        self._cursor.execute("INSERT OR REPLACE INTO parsed_urls (url, ts) VALUES (?, ?)", (url, int(time.time())))
+
+    def _commit_if_needed(self):
+        """Commit the current transaction if it collects enough changed rows."""
+        if self.db_connection.total_changes - self._commit_state['committed_changes'] >= self.batch_size:
+            self.flush()
+
+    def _get_schema(self):
+        """Load names of existing tables if they are unknown yet. Child tables of databases created before
+        indexing are indexed by parent_id here."""
+        if not self._schema:
+            tables = self._cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';").fetchall()
+            for table, create_q in tables:
+                if not table.lower().startswith('main') and 'parent_id' in create_q.lower():
+                    self._create_parent_index(table)
+            self._schema.update({table: None for table, _ in tables})
+        return self._schema
+
+    def _create_parent_index(self, table):
+        self._cursor.execute("CREATE INDEX IF NOT EXISTS ix_{0}_parent_id ON {0}(parent_id)".format(table))
+
+    def _get_columns(self, table):
+        """Return set of table's columns. Columns are loaded from the database only once."""
+        columns = self._get_schema().get(table)
+        if columns is None:
+            columns = {row[1] for row in self._cursor.execute("PRAGMA table_info({})".format(table))}
+            self._schema[table] = columns
+        return columns
+
+    def _get_seen_ids(self, table, column_id='id'):
+        """Return set of ids recorded in the table. Ids are loaded from the database only once."""
+        seen_ids = self._seen_ids.get(table)
+        if seen_ids is None:
+            seen_ids = {row[0] for row in self._cursor.execute("SELECT {} FROM {}".format(column_id, table))}
+            self._seen_ids[table] = seen_ids
+        return seen_ids
+
+    def _check_table_existion(self, table):
+        return table in self._get_schema()
+
+    def _create_table(self, table, columns=()):
+        """Create table with basic columns. Some specific tables has it's own creation string.
+        Columns of the first inserting data are created in the same statement to avoid altering a new table.
+        Child tables are indexed by parent_id for joining them with the main tables."""
         if table.lower() == self._main_table:
-            create_q = '''CREATE TABLE {}(
+            create_q = '''CREATE TABLE IF NOT EXISTS {}(
                     id TEXT PRIMARY KEY 
                     );'''.format(self._main_table)
         elif table.lower() == 'errs':
-            create_q = '''CREATE TABLE errs(
+            create_q = '''CREATE TABLE IF NOT EXISTS errs(
                           id INTEGER PRIMARY KEY AUTOINCREMENT,
                           parent_id TEXT,
                           URL TEXT,
@@ -250,18 +454,47 @@ class StorageAdapterSQLite(StorageAdapter):
                           exception TEXT
                           );'''
         else:
-            create_q = '''CREATE TABLE {}(
+            # SQLite compares column names case-insensitively, so different cases of one name are the same column.
+            unique_columns = {}
+            for col in columns:
+                unique_columns.setdefault(col.lower(), col)
+            unique_columns.pop('id', None)
+            unique_columns.pop('parent_id', None)
+            create_q = '''CREATE TABLE IF NOT EXISTS {}(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    parent_id TEXT
-                    );'''.format(table)
+                    parent_id TEXT{}
+                    );'''.format(table, "".join([",\n{} TEXT".format(col)
+                                                 for col in unique_columns.values()]))
         self._cursor.execute(create_q)
+        if table.lower() != self._main_table:
+            self._create_parent_index(table)
+        self._get_schema()[table] = None
 
     def _create_columns(self, table, columns):
         """Function take list of potential new columns and check their excision.
-        Part of them which doesn't exist will be created."""
-        new_columns = set(columns) - set(np.array(self._cursor.execute("PRAGMA table_info({})".format(table)).
-                                                  fetchall())[:, 1])
-        [self._cursor.execute("ALTER TABLE {} ADD COLUMN {} TEXT".format(table, col)) for col in new_columns]
+        Part of them which doesn't exist will be created. Threads share the schema, so columns are checked
+        and created under the lock of the connection."""
+        with self._lock:
+            known_columns = {col.lower() for col in self._get_columns(table)}
+            for col in dict.fromkeys(columns):
+                if col.lower() not in known_columns:
+                    self._cursor.execute("ALTER TABLE {} ADD COLUMN {} TEXT".format(table, col))
+                    self._get_columns(table).add(col)
+                    known_columns.add(col.lower())
+
+    def _get_statement(self, kind, table, cols, id_column='id'):
+        """Return parameterized INSERT or UPDATE string for the table's columns. Strings are built only once."""
+        key = (kind, table, tuple(cols), id_column)
+        statement = self._statements.get(key)
+        if statement is None:
+            if kind == 'insert':
+                statement = "INSERT INTO {} ({}, parent_id) values ({})".format(table, ",".join(cols),
+                                                                               ",".join(["?"] * (len(cols) + 1)))
+            else:
+                statement = "UPDATE {} SET {} WHERE {} = ?".format(table, ", ".join([col + " = ?" for col in cols]),
+                                                                   id_column)
+            self._statements[key] = statement
+        return statement
 
     def _add_rows(self, table: str, data: any, id_column: str = 'id', column_name=''):
         """
@@ -288,27 +521,18 @@ class StorageAdapterSQLite(StorageAdapter):
             if isinstance(data, dict):
                 cols = [column_name + '_' + preprocess_col_names(one_key) for one_key in data.keys()]
                 self._create_columns(table, cols)
-                data_to_sql = [None] * len(data) * 2
-                data_to_sql[::2] = cols
-                data_to_sql[1::2] = list(data.values())
-                self._cursor.execute(str("UPDATE {} SET " + ", ".join(["{} = '{}'"] * len(data)) + " WHERE {} = '{}'").
-                                     format(table, *data_to_sql, id_column, self._data_id))
+                self._cursor.execute(self._get_statement('update', table, cols, id_column),
+                                     (*[str(value) for value in data.values()], self._data_id))
             elif isinstance(data, pd.DataFrame):
                 cols = [preprocess_col_names(col) for col in data.columns.to_list()]
                 self._create_columns(table, cols)
-                data.apply(lambda x:
-                           self._cursor.execute(str("INSERT INTO {} (" +
-                                                    ",".join(["{}"] * len(cols)) +
-                                                    ", parent_id) values (" +
-                                                    ",".join(["'{}'"] * len(cols)) +
-                                                    ", '{}')").
-                                                format(table, *cols, *x, self._data_id)),
-                           axis=1)
+                self._cursor.executemany(self._get_statement('insert', table, cols),
+                                         ((*row, self._data_id) for row in
+                                          data.astype(str).itertuples(index=False, name=None)))
             elif column_name:
                 self._create_columns(table, [column_name])
-                self._cursor.execute("UPDATE {} SET {} = '{}' WHERE {} = '{}'".
-                                     format(table, column_name, data, id_column, self._data_id))
-            self.db_connection.commit()
+                self._cursor.execute(self._get_statement('update', table, [column_name], id_column),
+                                     (str(data), self._data_id))
         except Exception as e:
             print(e)
             pass
@@ -340,6 +564,13 @@ class BasicParser:
     :param _child_drivers: the list of webdrivers for child parsers.
     :type _child_drivers: list
 
+    :param _page: parsed source of the driver's current page. It's shared by all lookups of the page.
+    :type _page: lxml.html.HtmlElement
+
+    :param _page_number_ignored: flag set after a paginated table is found to ignore pageNumber in url.
+    Next tables of the parser are switched with the next page button at once.
+    :type _page_number_ignored: bool
+
     ..note:: The flag 'fast' needs list of webdrivers defined outside and transmitted to the class constructor.
     """
     __metaclass__ = ABCMeta
@@ -351,6 +582,8 @@ class BasicParser:
         self.driver = driver
         self.main_url = driver.current_url
         self.fast = fast
+        self._page = None
+        self._page_number_ignored = False
         self._id = self._parse_id()
         self._func_dict = None
         self._child_drivers = None
@@ -374,9 +607,15 @@ class BasicParser:
         """Search in specified block data which can be used to identify the record"""
         pass
 
+    def _get_page(self):
+        """Parse source of the current page. The tree is reused until another page is loaded to the driver."""
+        if self._page is None:
+            self._page = lxml.html.fromstring(self.driver.page_source, parser=_HTML_PARSER)
+        return self._page
+
     def _get_child_driver(self):
         """
-        Depending on 'fast' parameter return new webdriver or driver previously created.
+        Depending on 'fast' parameter return webdriver from the common pool or driver previously created.
 
         :return: webdriver for using in another parser
         :rtype: webdriver
@@ -384,66 +623,71 @@ class BasicParser:
         if self.fast and self._child_drivers:
             return self._child_drivers[0]
         else:
-            return parsing.utils.create_silent_driver()
+            return parsing.utils.acquire_driver()
 
     def _close_child_driver(self, child_driver: webdriver):
-        """Depending on 'fast' parameter destroy a new webdriver."""
+        """Depending on 'fast' parameter return a webdriver to the common pool."""
         if self.fast and self._child_drivers:
             pass
         else:
-            child_driver.quit()
+            parsing.utils.release_driver(child_driver)
 
-    def _get_from_href(self, parser: bs4.BeautifulSoup):
+    def _get_from_href(self, parser: lxml.html.HtmlElement):
         """
          Check if parser collects a link in tag <a> and return specific data.
 
         :param parser: unknown tag with data
-        :type parser: bs4.BeautifulSoup
+        :type parser: lxml.html.HtmlElement
 
         :return: link or text from tag
         :rtype: str
         """
         try:
-            href = parser.find('a')
+            href = parser.find('.//a')
             if href is not None:
-                return href['href']
+                return href.attrib['href']
             else:
-                return preprocess_str(parser.text)
+                return preprocess_str(parser.text_content())
         except Exception as e:
-            self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
+            self._storage.add_error_data(self.main_url, element_to_str(parser), '_get_from_href', e)
             pass
             return ""
 
-    def _get_divided_data(self, parser: bs4.BeautifulSoup):
+    def _get_divided_data(self, parser: lxml.html.HtmlElement):
         """
         Search data separated with sep_list's tags and union it in one string.
+        Elements of all tags are collected in one tree traversal, text of every tag follows the previous one.
+        An element without children contains only text, so it's returned at once.
 
         :param parser: page element with data
-        :type parser: bs4.BeautifulSoup
+        :type parser: lxml.html.HtmlElement
 
         :return: united data from the page
         :rtype: str
         """
         sep_list = ['div', 'span']
-        all_text = []
+        all_elements = {one_sep: [] for one_sep in sep_list}
         try:
-            for one_sep in sep_list:
-                all_elements = parser.find_all(one_sep)
-                if len(all_elements) > 0:
-                    all_text = all_text + [self._get_from_href(one_element) for one_element in all_elements]
+            if len(parser) == 0:
+                return preprocess_str(parser.text_content())
+            for one_element in parser.iterdescendants(*sep_list):
+                all_elements[one_element.tag].append(one_element)
+            all_text = [self._get_from_href(one_element)
+                        for one_sep in sep_list for one_element in all_elements[one_sep]]
             if len(all_text) == 0:
                 return self._get_from_href(parser)
             else:
                 return '; '.join(all_text)
         except Exception as e:
-            self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
+            self._storage.add_error_data(self.main_url, element_to_str(parser), '_get_divided_data', e)
             pass
             return ""
 
     def _get_from_table(self, parser: tuple):
         """
         Main function for parsing data from tag <table>. If one or more cells contain another table this data will be
-        reorganized to one-dimensional and put to 'spec' column.
+        put to 'spec' column as a nested dataframe saved to JSON string with 'split' orientation,
+        it can be restored with pd.read_json(spec, orient='split'). Earlier versions stored repr of the dataframe.
 
         :param parser: pair of a table's label and a page element.
         :type parser: tuple
@@ -457,52 +701,53 @@ class BasicParser:
         """
         parser = parser[0]
         data = None
-        parsed_table = parser.find('table')
+        parsed_table = parser.find('.//table')
         if parsed_table is not None:
+            columns = None
+            rows = []
+            specs = {}
             try:
-                parsed_cols = parsed_table.find('thead').find_all(['td', 'th'])
-                parsed_rows = parsed_table.find('tbody').find_all('tr', recursive=False)
-                columns = [preprocess_str(one_col.text) for one_col in parsed_cols]
+                parsed_cols = _XPATH_HEADER_CELLS(parsed_table.find('.//thead'))
+                parsed_rows = parsed_table.find('.//tbody').findall('tr')
+                columns = [preprocess_str(one_col.text_content()) for one_col in parsed_cols]
                 columns.append('additional')
                 columns.append('spec')
-                data = pd.DataFrame(None, columns=columns)
 
                 for one_row in parsed_rows:
-                    if one_row.find('table') is not None:
-                        add_spec = self._get_from_inner_table(one_row.find('table'))
-                        if add_spec is not None:
-                            data.iloc[-1, -1] = np.vstack((np.array([add_spec.columns.to_numpy()]),
-                                                           add_spec.to_numpy()))
+                    inner_table = one_row.find('.//table')
+                    if inner_table is not None:
+                        add_spec = self._get_from_inner_table(inner_table)
+                        if add_spec is not None and rows:
+                            specs[len(rows) - 1] = add_spec
                     else:
-                        parsed_rows_td = one_row.find_all('td')
-                        new_data = [preprocess_str(one_td.text) for one_td in parsed_rows_td]
+                        parsed_rows_td = _XPATH_CELLS(one_row)
+                        new_data = [preprocess_str(one_td.text_content()) for one_td in parsed_rows_td]
                         delta = (len(columns) - 2) - len(parsed_rows_td)
                         if delta == 0:
-                            data = data.append(pd.Series(new_data +
-                                                         [''] * 2, index=columns), ignore_index=True)
+                            rows.append(new_data + [''] * 2)
                         elif 0 < delta < 3:
                             if columns[0]:
-                                data = data.append(pd.Series(new_data +
-                                                             [''] * delta +
-                                                             [''] * 2, index=columns), ignore_index=True)
+                                rows.append(new_data + [''] * delta + [''] * 2)
                             else:
-                                data = data.append(pd.Series([''] * delta +
-                                                             new_data +
-                                                             [''] * 2, index=columns), ignore_index=True)
+                                rows.append([''] * delta + new_data + [''] * 2)
                         else:
-                            data.iloc[-1, -2] = "; ".join(new_data)
+                            rows[-1][-2] = "; ".join(new_data)
             except Exception as e:
-                self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
+                self._storage.add_error_data(self.main_url, element_to_str(parser), '_get_from_table', e)
                 pass
             finally:
+                if columns is not None:
+                    for i, add_spec in specs.items():
+                        rows[i][-1] = add_spec.to_json(orient='split', force_ascii=False)
+                    data = pd.DataFrame(rows, columns=columns)
                 return data
 
-    def _get_from_inner_table(self, parser: bs4.BeautifulSoup):
+    def _get_from_inner_table(self, parser: lxml.html.HtmlElement):
         """
         Additional function for parsing data from nested tags <table>.
 
         :param parser: page element collecting tag <table>
-        :type parser: bs4.BeautifulSoup
+        :type parser: lxml.html.HtmlElement
 
         :return: table-like text or link information
         :rtype: pd.DataFrame
@@ -512,23 +757,28 @@ class BasicParser:
         """
         data = None
         if parser is not None:
+            columns = None
+            rows = []
             try:
-                parsed_cols = parser.find('thead').find_all(['td', 'th'])
-                parsed_rows = parser.find('tbody').find_all('tr')
-                columns = [preprocess_str(one_col.text) for one_col in parsed_cols]
-                data = pd.DataFrame(None, columns=columns)
+                parsed_cols = _XPATH_HEADER_CELLS(parser.find('.//thead'))
+                parsed_rows = _XPATH_ROWS(parser.find('.//tbody'))
+                columns = [preprocess_str(one_col.text_content()) for one_col in parsed_cols]
                 for one_row in parsed_rows:
-                    parsed_rows_td = one_row.find_all('td')
+                    parsed_rows_td = _XPATH_CELLS(one_row)
+                    if len(parsed_rows_td) > len(columns):
+                        raise ValueError('Row contains more cells than the table header.')
                     if len(parsed_rows_td) != len(columns):
                         add_col = [''] * (len(columns) - len(parsed_rows_td)) + \
-                                  [preprocess_str(one_td.text) for one_td in parsed_rows_td]
+                                  [preprocess_str(one_td.text_content()) for one_td in parsed_rows_td]
                     else:
-                        add_col = [preprocess_str(one_td.text) for one_td in parsed_rows_td]
-                    data = data.append(pd.Series(add_col, index=columns), ignore_index=True)
+                        add_col = [preprocess_str(one_td.text_content()) for one_td in parsed_rows_td]
+                    rows.append(add_col)
             except Exception as e:
-                self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
+                self._storage.add_error_data(self.main_url, element_to_str(parser), '_get_from_inner_table', e)
                 pass
             finally:
+                if columns is not None:
+                    data = pd.DataFrame(rows, columns=columns)
                 return data
 
     def _get_from_single_section(self, parser: tuple):
@@ -543,20 +793,104 @@ class BasicParser:
         :rtype: dict
         """
         parser = parser[0]
-        all_sections = parser.find_all('section')
         result_sections = {}
         try:
-            for one_section in all_sections:
-                all_span = one_section.find_all('span')
-                if len(all_span) == 2:
-                    result_sections[preprocess_str(all_span[0].text)] = self._get_divided_data(all_span[1])
+            for one_section in _XPATH_PAIRED_SECTIONS(parser):
+                label_span, data_span = _XPATH_SPANS(one_section)
+                result_sections[preprocess_str(label_span.text_content())] = self._get_divided_data(data_span)
         except Exception as e:
-            self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
+            self._storage.add_error_data(self.main_url, element_to_str(parser), '_get_from_single_section', e)
             pass
         finally:
             return result_sections
 
-    def _add_data_to_dataframe(self, label, parser: bs4.BeautifulSoup, n=0):
+    def _get_paginated_table(self, container_id: str, label: str):
+        """
+        Collect table from the container placed on several pages.
+
+        :param container_id: id of the tag <div> containing the table
+        :type container_id: str
+
+        :param label: name of the high-level data block.
+        :type label: str
+
+        :return: table-like information from all pages, empty if there is no rows
+        :rtype: pd.DataFrame
+
+        ..note:: HTML of the container, presence of the next page button and number of pages in the paginator
+        are requested with one script call. Next pages are loaded directly by their numbers if the second page
+        loaded this way differs from the first one, otherwise they are switched with the next page button
+        for this and next tables of the parser.
+        Loading stops after the last page of the paginator or if the page repeats the previous one.
+        """
+        page_url = urlsplit(self.driver.current_url)
+        page_query = [(key, value) for key, value in parse_qsl(page_url.query, keep_blank_values=True)
+                      if key != 'pageNumber']
+        all_data = []
+        previous_html = None
+        page_number = 1
+        by_number = False if self._page_number_ignored else None
+        container = self._get_container_page(container_id)
+        while container is not None:
+            inner_html, has_next_page, pages_amount = container
+            if inner_html == previous_html:
+                if has_next_page:
+                    self._storage.add_error_data(self.main_url, self.driver.current_url, '_get_paginated_table',
+                                                 'Page {} repeats the previous one'.format(page_number))
+                break
+            page_data = self._get_from_table((parse_html(inner_html), label))
+            if page_data is not None and not page_data.empty:
+                all_data.append(page_data)
+            if not has_next_page or 0 < pages_amount <= page_number:
+                break
+            previous_html = inner_html
+            page_number += 1
+            if by_number is False:
+                container = self._click_next_page(container_id)
+                continue
+            self.driver.get(urlunsplit(page_url._replace(
+                query=urlencode(page_query + [('pageNumber', page_number)]))))
+            container = self._get_container_page(container_id)
+            if by_number is None:
+                by_number = container is None or container[0] != previous_html
+                if not by_number:
+                    self._page_number_ignored = True
+                    container = self._click_next_page(container_id)
+        return pd.concat(all_data, ignore_index=True, sort=False, copy=False) if all_data else pd.DataFrame()
+
+    def _get_container_page(self, container_id: str):
+        """
+        Request HTML of the container, presence of the next page button and number of pages with one script call.
+
+        :param container_id: id of the tag <div> containing the table
+        :type container_id: str
+
+        :return: HTML, presence of the next page button and number of pages or None if there is no container
+        :rtype: list
+        """
+        return self.driver.execute_script(_JS_CONTAINER_PAGE, container_id, _NEXT_PAGE_BUTTON_SELECTOR)
+
+    def _click_next_page(self, container_id: str):
+        """
+        Switch the container to the next page with the paginator button. Used if the page ignores its number in url.
+
+        :param container_id: id of the tag <div> containing the table
+        :type container_id: str
+
+        :return: container of the next page like _get_container_page or None if the page isn't switched
+        :rtype: list
+        """
+        # noinspection PyBroadException
+        try:
+            element = self.driver.find_element_by_css_selector(_NEXT_PAGE_BUTTON_SELECTOR)
+            self.driver.execute_script('arguments[0].click();', element)
+            wait(self.driver, 15, poll_frequency=_WAIT_POLL_FREQUENCY).until(ec.staleness_of(element))
+        except Exception as e:
+            self._storage.add_error_data(self.main_url, self.driver.current_url, '_click_next_page', e)
+            return None
+        return self._get_container_page(container_id)
+
+    def _add_data_to_dataframe(self, label, parser: lxml.html.HtmlElement, n=0):
         """
         The function gains information from transferred parser and put it in dictionary.
 
@@ -564,7 +898,7 @@ class BasicParser:
         :type label: str
 
         :param parser: page element with the high-level data block.
-        :type parser: bs4.BeautifulSoup
+        :type parser: lxml.html.HtmlElement
 
         :param n: index number of the high-level data block
         :type n: int
@@ -573,7 +907,10 @@ class BasicParser:
         webpage. Next it creates a new item of basic data into the _storage if data contains tag <table> or
         adds information to existing item named 'main'.
         """
-        data = self._func_dict.get(label)((parser, label)) if self._func_dict.get(label) is not None else None
+        parse_function = self._func_dict.get(label)
+        if parse_function is None:
+            return
+        data = parse_function((parser, label))
         if data is None:
             pass
         elif isinstance(data, pd.DataFrame):
@@ -594,24 +931,27 @@ class BasicParser:
         """
         Parsing entry point.
         Find basic blocks from the webpage specified by main_url,
-        then turn them into BeautifulSoup parsers with specific names. Next step it mines information
+        then turn them into lxml elements with specific names. Next step it mines information
         from founded HTML-blocks and records to general repository.
+        The page source is requested from the driver and parsed once for all blocks and other page lookups.
+        The tree taken by the constructor for the id may be stale, so the source is requested again here.
         """
         if self._storage.is_new:
-            all_info_parsed = list(map(lambda x: bs4.BeautifulSoup(x.get_attribute('innerHTML'), 'lxml'),
-                                       self.driver.find_elements_by_xpath("//div[@class='row blockInfo']/div")))
-            i = 0
-            for parser in all_info_parsed:
-                try:
-                    i += 1
-                    if parser.find('h2') is not None:
-                        block_name = preprocess_str(parser.find('h2').text)
-                        self._add_data_to_dataframe(block_name, parser, i)
-                except Exception as e:
-                    self._storage.add_error_data(self.main_url, parser, inspect.stack()[0][3], e)
-                    pass
-            self._add_child_id()
-            self._storage.roll_data()
+            with self._storage.transaction():
+                self._page = None
+                all_info_parsed = _XPATH_BLOCKS(self._get_page())
+                i = 0
+                for parser in all_info_parsed:
+                    try:
+                        i += 1
+                        if parser.find('.//h2') is not None:
+                            block_name = preprocess_str(parser.find('.//h2').text_content())
+                            self._add_data_to_dataframe(block_name, parser, i)
+                    except Exception as e:
+                        self._storage.add_error_data(self.main_url, element_to_str(parser), 'parse_page', e)
+                        pass
+                self._add_child_id()
+                self._storage.roll_data()
 
 
 class CustomerParser(BasicParser):
@@ -653,10 +993,9 @@ class CustomerParser(BasicParser):
         """
         # noinspection PyBroadException
         try:
-            new_id = self.driver.find_element_by_xpath("//h2[text()='Идентификационный код заказчика (ИКУ)']"). \
-                find_element_by_xpath('..'). \
-                find_element_by_xpath("section[@class='blockInfo__section']/span[@class='section__info']")
-            return re.sub('[^0-9]', '', new_id.text)
+            new_id = self._get_page().xpath("//h2[text()='Идентификационный код заказчика (ИКУ)']/.."
+                                            "/section[@class='blockInfo__section']/span[@class='section__info']")
+            return _RE_NON_DIGITS.sub('', new_id[0].text_content())
         except Exception:
             return self.main_url
 
@@ -691,9 +1030,9 @@ class OrderParser(BasicParser):
         :return: new inner id
         :rtype: str
         """
-        new_id = self.driver.find_elements_by_xpath("//span[@class='cardMainInfo__purchaseLink distancedText']")
+        new_id = self._get_page().xpath("//span[@class='cardMainInfo__purchaseLink distancedText']")
         if len(new_id) > 0:
-            return re.sub('[^0-9]', '', new_id[0].text)
+            return _RE_NON_DIGITS.sub('', new_id[0].text_content())
         else:
             return self.main_url
 
@@ -723,8 +1062,8 @@ class OrderParser(BasicParser):
         :rtype: dict
         """
         new_values = self._get_from_single_section(parser)
-        new_state = self.driver.find_elements_by_xpath("//span[@class='cardMainInfo__state distancedText']")
-        new_values['state'] = new_state[0].text if len(new_state) > 0 else "Неизвестен"
+        new_state = self._get_page().xpath("//span[@class='cardMainInfo__state distancedText']")
+        new_values['state'] = " ".join(new_state[0].text_content().split()) if len(new_state) > 0 else "Неизвестен"
         self.data_customer = self._create_customer_section(new_values['Размещение осуществляет'])
         return new_values
 
@@ -748,7 +1087,7 @@ class OrderParser(BasicParser):
                                 fast=self.fast)
             cp.parse_page()
         except Exception as e:
-            self._storage.add_error_data(self.main_url, self.driver.current_url, inspect.stack()[0][3], e)
+            self._storage.add_error_data(self.main_url, self.driver.current_url, '_create_customer_section', e)
             pass
         finally:
             self._close_child_driver(child_driver)
@@ -756,31 +1095,15 @@ class OrderParser(BasicParser):
 
     def _create_trade_section(self, parser: tuple):
         """
-        Take information from the one of basic blocks contained purchased goods. Simulates page switching if necessary.
+        Take information from the one of basic blocks contained purchased goods. Loads next pages if necessary.
 
         :param parser: tuple of a page with specific table and its label.
         :type parser: tuple
 
-        :return: table-like information from given page
+        :return: table-like information from given page, empty if there is no rows
         :rtype: pd.DataFrame
         """
-        label = parser[1]
-        element = True
-        all_data = pd.DataFrame(None)
-        search_string = "//div[@id='positionKTRU' and @class='container']".format(label)
-        while element is not None:
-            pass
-            block = self.driver.find_element_by_xpath(search_string)
-            html = bs4.BeautifulSoup(block.get_attribute('innerHTML'), 'lxml')
-            all_data = all_data.append(self._get_from_table((html, label)), sort=False)
-            # noinspection PyBroadException
-            try:
-                element = self.driver.find_element_by_xpath("//a[@class='paginator-button paginator-button-next']")
-                self.driver.execute_script('arguments[0].click();', element)
-                wait(self.driver, 15).until(ec.staleness_of(element))
-            except Exception:
-                element = None
-        return all_data
+        return self._get_paginated_table(_ORDER_GOODS_CONTAINER, parser[1])
 
     def _add_child_id(self):
         """Create link between this order and the customer."""
@@ -795,6 +1118,9 @@ class ContractParser(BasicParser):
     :param data_order: parser for an order page
     :type data_order: OrderParser
 
+    :param _order_parsed: flag for collecting the order information only once
+    :type _order_parsed: bool
+
     .. note:: Sample url: https://zakupki.gov.ru/epz/contract/contractCard/common-info.html?reestrNumber=xxx
     """
 
@@ -805,6 +1131,7 @@ class ContractParser(BasicParser):
         super().__init__(driver, storage, fast, child_drivers)
         self._storage.set_identifiers(self._id, 'contract')
         self.data_order = None
+        self._order_parsed = False
         self._create_dicts()
         self._parse_basics()
 
@@ -818,8 +1145,8 @@ class ContractParser(BasicParser):
                            }
 
     def _parse_id(self):
-        new_id = self.driver.find_elements_by_xpath("//span[@class='cardMainInfo__purchaseLink distancedText']")
-        return re.sub('[^0-9]', '', new_id[0].text) if len(new_id) > 0 else self.main_url
+        new_id = self._get_page().xpath("//span[@class='cardMainInfo__purchaseLink distancedText']")
+        return _RE_NON_DIGITS.sub('', new_id[0].text_content()) if len(new_id) > 0 else self.main_url
 
     def _parse_basics(self):
         """
@@ -830,8 +1157,9 @@ class ContractParser(BasicParser):
         order parser and puts in the data_order field.
         """
         try:
-            order_href = self.driver.find_element_by_xpath(
-                "//a[contains(text(), '{}')]".format('Закупка')).get_attribute('href')
+            order_href = urljoin(self.driver.current_url,
+                                 self._get_page().xpath("//a[contains(text(), '{}')]".format('Закупка'))[0].
+                                 attrib['href'])
             driver_order = self._get_child_driver()
             driver_order.get(order_href)
             self.data_order = OrderParser(driver_order,
@@ -840,16 +1168,18 @@ class ContractParser(BasicParser):
             if len(self._child_drivers) > 1:
                 self.data_order.set_child_drivers([self._child_drivers[1]])
         except Exception as e:
-            self._storage.add_error_data(self.main_url, self.driver.current_url, inspect.stack()[0][3], e)
+            self._storage.add_error_data(self.main_url, self.driver.current_url, '_parse_basics', e)
 
     def _add_child_id(self):
         """
         ..note:: Create order parser and collect relevant information. If the contract has no order
         purchasing goods should be taken from the contract's second page, this requires page changing and
-        repeated parsing. To avoid looping this function checks current url in selenium driver and don't parse
-        the second page repeatedly.
+        repeated parsing. To avoid looping this function marks the order as parsed and don't parse
+        the second page repeatedly. Url of the driver can't be checked because goods tables change it
+        loading their next pages.
         """
-        if self.driver.current_url == self.main_url:
+        if not self._order_parsed:
+            self._order_parsed = True
             self._parse_order()
 
     def _parse_order(self):
@@ -866,7 +1196,7 @@ class ContractParser(BasicParser):
                 self.data_order.parse_page()
                 self._storage.add_main_data('order_id', self.data_order.get_id())
             except Exception as e:
-                self._storage.add_error_data(self.main_url, self.driver.current_url, inspect.stack()[0][3], e)
+                self._storage.add_error_data(self.main_url, self.driver.current_url, '_parse_order', e)
                 pass
             finally:
                 self._close_child_driver(self.data_order.driver)
@@ -878,52 +1208,49 @@ class ContractParser(BasicParser):
                         self._id))
                 self.parse_page()
             except Exception as e:
-                self._storage.add_error_data(self.main_url, self.driver.current_url, inspect.stack()[0][3], e)
+                self._storage.add_error_data(self.main_url, self.driver.current_url, '_parse_order', e)
                 pass
 
     def _create_trade_section(self, parser):
         """
-        Take information from the one of basic blocks contained purchased goods. Simulates page switching if necessary.
+        Take information from the one of basic blocks contained purchased goods. Loads next pages if necessary.
 
         :param parser: tuple of a page with specific table and its label.
         :type parser: tuple
 
-        :return: table-like information from given page
+        :return: table-like information from given page, empty if there is no rows
         :rtype: pd.DataFrame
         """
-        label = parser[1]
-        element = True
-        all_data = pd.DataFrame(None)
-        search_string = "//div[@id='contractSubjects' and @class='container']".format(label)
-        while element is not None:
-            pass
-            block = self.driver.find_element_by_xpath(search_string)
-            html = bs4.BeautifulSoup(block.get_attribute('innerHTML'), 'lxml')
-            all_data = all_data.append(self._get_from_table((html,
-                                                             label)), sort=False)
-            # noinspection PyBroadException
-            try:
-                element = self.driver.find_element_by_xpath("//a[@class='paginator-button paginator-button-next']")
-                self.driver.execute_script('arguments[0].click();', element)
-                wait(self.driver, 15).until(ec.staleness_of(element))
-            except Exception:
-                element = None
-        return all_data
+        return self._get_paginated_table(_CONTRACT_GOODS_CONTAINER, parser[1])
+
+
+def parse_html(inner_html: str):
+    """Build lxml tree from the inner HTML of a page element. Fragments are wrapped with one tag <div>."""
+    return lxml.html.fragment_fromstring(inner_html, create_parent='div', parser=_HTML_PARSER)
+
+
+def element_to_str(element):
+    """Serialize a page element to keep it in the errors table."""
+    return lxml.html.tostring(element, encoding='unicode')
 
 
 def preprocess_str(new_str: str):
-    """Collecting text should contain only letter, number and some punctuation."""
-    new_str = re.sub('[^а-яА-Яa-zA-Z0-9+:/@.,(-) ]', '', str(new_str))
-    new_str = re.sub('\s+', ' ', new_str)
+    """Collecting text should contain only letter, number and some punctuation. Clean text is returned at once."""
+    new_str = str(new_str)
+    if _RE_STR_DIRTY.search(new_str) is None:
+        return new_str
+    new_str = _RE_STR_EXCESS.sub('', new_str)
+    new_str = _RE_SPACES.sub(' ', new_str)
     return new_str.strip()
 
 
+@functools.lru_cache(maxsize=4096)
 def preprocess_col_names(new_str: str):
-    new_str = re.sub('[^а-яА-Яa-zA-Z0-9_ ]', '', new_str)
-    new_str = re.sub('\s+', '_', new_str).strip()
+    new_str = _RE_COL_NAME_EXCESS.sub('', new_str)
+    new_str = _RE_SPACES.sub('_', new_str).strip()
     return new_str if new_str else 'other'
 
 
 def join_for_columns(x):
-    """Auxiliary function for uniting columns in tables"""
-    return ';'.join(set(x.astype(str)))
+    """Auxiliary function for uniting columns in tables. Unique values are kept in order of their appearance."""
+    return ';'.join(dict.fromkeys(value if isinstance(value, str) else str(value) for value in x))
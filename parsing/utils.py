@@ -1,29 +1,133 @@
 import re
 import os
+import csv
 import time
+import queue
+import atexit
 import sqlite3
 import pathlib
-import numpy as np
 import pandas as pd
+import requests
+import lxml.html
 from math import ceil
+from itertools import chain
+from urllib.parse import urljoin
+import threading
 import multiprocessing
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 from parsing import parser
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as ec
+from selenium.webdriver.support.ui import WebDriverWait as wait
 
+_RE_NON_DIGITS = re.compile('[^0-9]')
+_SEARCH_HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0'}
+_driver_pool = queue.Queue(maxsize=3)
+_QUARTERS = (('01.01', '31.03'), ('01.04', '30.06'), ('01.07', '30.09'), ('01.10', '31.12'))
 
-def create_silent_driver():
+
+def create_silent_driver(page_load_strategy: str = 'normal'):
     """
     Create selenium webdriver without visualization.
 
+    :param page_load_strategy: 'normal' waits for all page resources to load,
+    'eager' returns after the HTML document is loaded and parsed, blocks filled by scripts may be absent yet.
+    :type page_load_strategy: str
+
     :return: new webdriver
     :rtype: webdriver
     """
     options = Options()
     options.add_argument('--headless')
+    capabilities = DesiredCapabilities.FIREFOX.copy()
+    capabilities['pageLoadStrategy'] = page_load_strategy
     return webdriver.Firefox(executable_path=r'c:\ProgramData\geckodriver.exe',
-                             options=options)
+                             options=options,
+                             capabilities=capabilities)
+
+
+def acquire_driver():
+    """
+    Take an idle webdriver from the pool. New webdriver is created if the pool is empty.
+
+    :return: webdriver
+    :rtype: webdriver
+    """
+    try:
+        return _driver_pool.get_nowait()
+    except queue.Empty:
+        return create_silent_driver()
+
+
+def release_driver(driver: webdriver):
+    """
+    Return webdriver to the pool for using by the next parser. Webdriver is destroyed if the pool is full.
+
+    :param driver: webdriver which isn't used anymore
+    :type driver: webdriver
+
+    ..note:: The pool is a module-level queue with maxsize=3. It's shared by all threads of the process,
+    every process importing utils has its own pool. Webdriver with a broken session is destroyed
+    and never returns to the pool.
+    """
+    # noinspection PyBroadException
+    try:
+        driver.delete_all_cookies()
+    except Exception:
+        # noinspection PyBroadException
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        return
+    try:
+        _driver_pool.put_nowait(driver)
+    except queue.Full:
+        driver.quit()
+
+
+def close_driver_pool():
+    """Destroy all idle webdrivers kept in the pool."""
+    while True:
+        try:
+            _driver_pool.get_nowait().quit()
+        except queue.Empty:
+            break
+        except Exception as e:
+            print(e)
+
+
+atexit.register(close_driver_pool)
+
+
+def create_db_connection(db_path: str, check_same_thread: bool = True):
+    """
+    Open connection to the SQLite database tuned for a long writing session.
+
+    :param db_path: path to the database file
+    :type db_path: str
+
+    :param check_same_thread: flag for allowing the connection only in the creating thread
+    :type check_same_thread: bool
+
+    :return: new connection
+    :rtype: sqlite3.Connection
+
+    ..note:: Write-ahead log with the normal synchronous mode syncs the file only on checkpoints
+    instead of every commit, the database still can't be corrupted by an application crash.
+    Temporary tables and indices are kept in memory, the page cache is extended to 64 Mb.
+    Every parsed table has its own INSERT and UPDATE statements, so the cache of prepared statements is extended too.
+    """
+    db_connection = sqlite3.connect(db_path, check_same_thread=check_same_thread, cached_statements=512)
+    db_connection.execute("PRAGMA journal_mode=WAL")
+    db_connection.execute("PRAGMA synchronous=NORMAL")
+    db_connection.execute("PRAGMA temp_store=MEMORY")
+    db_connection.execute("PRAGMA cache_size=-65536")
+    return db_connection
 
 
 def unite_two_dicts(source: dict, destination: dict, postfix: str):
@@ -33,7 +137,7 @@ def unite_two_dicts(source: dict, destination: dict, postfix: str):
     :param source: adding dictionary
     :type source: dict
 
-    :param destination: receiving dictionary
+    :param destination: receiving dictionary with lists of dataframes
     :type destination: dict
 
     :param postfix: additional string to distinguish different data source
@@ -44,16 +148,26 @@ def unite_two_dicts(source: dict, destination: dict, postfix: str):
     """
     try:
         for one_element in source.items():
-            label = one_element[0] + postfix
-            df = one_element[1]
-            new_df = df if destination.get(label) is None else destination.get(label).append(df, sort=False)
-            destination[label] = new_df
+            destination.setdefault(one_element[0] + postfix, []).append(one_element[1])
     except Exception as e:
         print(e)
     finally:
         return destination
 
 
+def finalize_dict(df_dict: dict):
+    """
+    Unite collected dataframes of every label in one dataframe.
+
+    :param df_dict: dictionary with lists of dataframes
+    :type df_dict: dict
+
+    :return: dictionary with dataframes
+    :rtype: dict
+    """
+    return {label: pd.concat(all_df, sort=False) for label, all_df in df_dict.items()}
+
+
 def from_parser_to_dict(bp: parser.BasicParser, df_dict: dict):
     """
     Write parsed data to dict.
@@ -62,7 +176,7 @@ def from_parser_to_dict(bp: parser.BasicParser, df_dict: dict):
     :param bp: object with parsed data
     :type bp: ps.BasicParser
 
-    :param df_dict: dictionary with dataframes collecting parsed data
+    :param df_dict: dictionary with lists of dataframes collecting parsed data
     :type df_dict: dict
 
     :return: inputted dictionary
@@ -119,44 +233,52 @@ def create_searching_urls(conditions: list, use_slicing=True, basic_string: str
     if use_slicing:
         first_year = 2015
         last_year = date.today().year
-        sliced_dates = ["publishDateFrom=01.01.{}&publishDateTo=31.03.{}".format(one_year,
-                                                                                 one_year)
-                        for one_year in range(first_year, last_year + 1, 1)
-                        ] + ["publishDateFrom=01.04.{}&publishDateTo=30.06.{}".format(one_year,
-                                                                                      one_year)
-                             for one_year in range(first_year, last_year + 1, 1)
-                             ] + ["publishDateFrom=01.07.{}&publishDateTo=30.09.{}".format(one_year,
-                                                                                           one_year)
-                                  for one_year in range(first_year, last_year + 1, 1)
-                                  ] + ["publishDateFrom=01.10.{}&publishDateTo=31.12.{}".format(one_year,
-                                                                                                one_year)
-                                       for one_year in range(first_year, last_year + 1, 1)
-                                       ]
+        sliced_dates = ["publishDateFrom={0}.{2}&publishDateTo={1}.{2}".format(quarter_start, quarter_end, one_year)
+                        for quarter_start, quarter_end in _QUARTERS
+                        for one_year in range(first_year, last_year + 1, 1)]
 
     def prepare_string(one_element):
         one_element = list(one_element.items())[0]
         url_string = basic_string + '&' + one_element[0] + '='
         return [url_string + str(condition) for condition in one_element[1]]
 
-    urls = np.hstack([prepare_string(one_element) for one_element in conditions])
+    urls = list(chain.from_iterable(prepare_string(one_element) for one_element in conditions))
     if use_slicing:
         urls = [one_url + '&' + one_slice for one_slice in sliced_dates for one_url in urls]
     return urls
 
 
-def get_search_amount(driver: webdriver):
+def load_search_page(session: requests.Session, url: str):
+    """
+    Load a searching page without the browser. Search results are rendered by the server.
+
+    :param session: http session keeping connections to the site
+    :type session: requests.Session
+
+    :param url: address of the searching page
+    :type url: str
+
+    :return: parsed page
+    :rtype: lxml.html.HtmlElement
+    """
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    return lxml.html.fromstring(response.content, base_url=response.url)
+
+
+def get_search_amount(page: lxml.html.HtmlElement):
     """
     Get number of found records.
 
-    :param driver: A page where function tries to find the data.
-    :type driver: webdriver
+    :param page: A page where function tries to find the data.
+    :type page: lxml.html.HtmlElement
 
     :return: number of records. If the element doesn't find returns 0.
     :rtype: int
     """
-    search_result = driver.find_elements_by_xpath("//div[@class='search-results__total']")
+    search_result = page.xpath("//div[@class='search-results__total']")
     if search_result:
-        search_result_text = re.sub('[^0-9]', '', search_result[0].text)
+        search_result_text = _RE_NON_DIGITS.sub('', search_result[0].text_content())
         return int(search_result_text) if search_result_text else 0
     else:
         return 0
@@ -165,6 +287,7 @@ def get_search_amount(driver: webdriver):
 def pool_url_list_to_csv(urls: list):
     """
     A parser getting order's or contract's urls from searching page. Can be used with multiprocessing.
+    Searching pages don't need a browser, so they are loaded through one http session.
 
     :param urls: list of searching urls
     :type urls: list
@@ -172,35 +295,32 @@ def pool_url_list_to_csv(urls: list):
     :return: urls of a concrete order, contract or else
     :rtype: list
     """
-    driver = create_silent_driver()
     order_urls = []
-    for url in urls:
-        try:
-            driver.get(url)
-            search_result = get_search_amount(driver)
-        except Exception as e:
-            print(url)
-            print(e)
-            search_result = 0
-            pass
-        i = 0
-        print('Total: {}'.format(search_result))
-        for page in range(1, ceil(search_result / 50) + 1):
-            driver.get("{}&pageNumber={}&recordsPerPage=_50".format(url, page))
-            one_page_blocks = driver.find_elements_by_xpath(
-                "//div[@class='search-registry-entry-block box-shadow-search-input']")
-            for one_page in one_page_blocks:
+    with requests.Session() as session:
+        session.headers.update(_SEARCH_HEADERS)
+        for url in urls:
+            try:
+                search_result = get_search_amount(load_search_page(session, url))
+            except Exception as e:
+                print(url)
+                print(e)
+                search_result = 0
+                pass
+            print('Total: {}'.format(search_result))
+            for page in range(1, ceil(search_result / 50) + 1):
+                page_url = "{}&pageNumber={}&recordsPerPage=_50".format(url, page)
                 try:
-                    i += 1
-                    new_url = one_page.find_element_by_class_name(
-                        "registry-entry__header-mid__number").find_element_by_xpath(
-                        "a").get_attribute('href')
-                    order_urls.append(new_url)
+                    search_page = load_search_page(session, page_url)
+                    for one_block in search_page.xpath(
+                            "//div[@class='search-registry-entry-block box-shadow-search-input']"):
+                        number_blocks = one_block.find_class('registry-entry__header-mid__number')
+                        href = number_blocks[0].find('a') if number_blocks else None
+                        if href is not None and href.get('href'):
+                            order_urls.append(urljoin(search_page.base_url, href.get('href')))
                 except Exception as e:
-                    print(driver.current_url)
+                    print(page_url)
                     print(e)
                     pass
-    driver.quit()
     return order_urls
 
 
@@ -223,6 +343,9 @@ def create_urls(urls_directory: str,
 
     :param slow: flag for multiprocessing
     :type slow: bool
+
+    ..note:: Search pages are downloaded with requests, no webdriver is used. With multiprocessing
+    searching urls are split between processes by turns, every process loads its part with its own session.
     """
     if conditions is None:
         conditions = [{'ktruCodeNameList': ['21.10.60.191-00000054', '32.50.22.190-00005106',
@@ -238,10 +361,14 @@ def create_urls(urls_directory: str,
     if slow:
         order_urls = pool_url_list_to_csv(urls)
     else:
-        with multiprocessing.Pool(processes=6) as pool:
-            order_urls = pool.map(pool_url_list_to_csv, [urls])
-    pd.DataFrame({'url': order_urls[0] if len(np.shape(order_urls)) > 1 else order_urls}).to_csv(
-        os.path.join(urls_directory, 'urls.csv'), sep=";", index=False)
+        processes = 6
+        url_parts = [part for part in (urls[i::processes] for i in range(processes)) if len(part) > 0]
+        with multiprocessing.Pool(processes=processes) as pool:
+            order_urls = list(chain.from_iterable(pool.map(pool_url_list_to_csv, url_parts)))
+    with open(os.path.join(urls_directory, 'urls.csv'), 'w', encoding='utf-8', newline='') as urls_file:
+        urls_writer = csv.writer(urls_file, delimiter=';')
+        urls_writer.writerow(['url'])
+        urls_writer.writerows([one_url] for one_url in order_urls)
     print('Finished.')
 
 
@@ -255,11 +382,23 @@ def load_urls(urls_directory: str):
     :return: read urls
     :rtype: pd.DataFrame
     """
-    urls = pd.DataFrame(None, columns=['url'])
-    for path in pathlib.Path(urls_directory).iterdir():
-        if path.is_file():
-            urls = urls.append(pd.read_csv(path, sep=';'), sort=False)
-    return urls.reset_index()
+    all_urls = [pd.read_csv(path, sep=';', usecols=['url'], dtype={'url': str})
+                for path in pathlib.Path(urls_directory).iterdir() if path.is_file()]
+    return pd.concat(all_urls, ignore_index=True) if all_urls else pd.DataFrame(None, columns=['url'])
+
+
+def load_parsed_urls(db_connection: sqlite3.Connection):
+    """
+    Get urls parsed in previous runs. The table of parsed urls is created if it doesn't exist.
+
+    :param db_connection: connection to the database with parsed data
+    :type db_connection: sqlite3.Connection
+
+    :return: set of parsed urls
+    :rtype: set
+    """
+    db_connection.execute("CREATE TABLE IF NOT EXISTS parsed_urls(url TEXT PRIMARY KEY, ts INTEGER)")
+    return {row[0] for row in db_connection.execute("SELECT url FROM parsed_urls")}
 
 
 def parse_sites(parser_name, settings, storage_type: str = 'df'):
@@ -275,44 +414,93 @@ def parse_sites(parser_name, settings, storage_type: str = 'df'):
     :param storage_type: string with information of a storage method.
     :type storage_type: str
 
+    ..note:: Pages are loaded by settings.fetch_workers threads, most of the time they wait for the browser.
+    Every thread creates three webdrivers and a storage once at start and reuses them for all its urls,
+    each url is parsed into a child of this storage. settings.page_load_strategy is applied to the first
+    webdriver only, it's followed by an explicit wait for the page blocks. Child webdrivers load order and
+    customer pages without such wait, so they always use the 'normal' strategy.
+    All threads share one database connection. Pages are loaded and parsed in parallel, but their data
+    is buffered and written by one thread at a time when the page transaction ends.
+    Dataframes are collected by every thread separately and united after all urls are parsed.
+    The database keeps parsed urls in the same page transactions as their data, so repeated runs
+    don't load these pages again and a failed page is parsed again in the next run.
     """
     start_time = time.time()
     df_dict = {}
-    drivers = [create_silent_driver(), create_silent_driver(), create_silent_driver()]
+    workers = []
+    worker_data = threading.local()
+    output_directory = settings.output_directory
+    page_load_strategy = settings.page_load_strategy
+    batch_size = settings.batch_size
+    schema = {}
+    statements = {}
+    seen_ids = {}
+    commit_state = None
+    db_lock = threading.RLock()
     urls = load_urls(settings.input_directory)
+    db_connection = None if storage_type == 'df' \
+        else create_db_connection(os.path.join(settings.db_directory, 'parsing.db'), check_same_thread=False)
+    if db_connection is not None:
+        urls = urls[~urls['url'].isin(load_parsed_urls(db_connection))]
+        commit_state = {'committed_changes': db_connection.total_changes}
     all_i = urls.shape[0]
-    storage = parser.StorageAdapterDataframe() if storage_type == 'df' \
-        else parser.StorageAdapterSQLite(db_connection := sqlite3.connect(os.path.join(settings.db_directory,
-                                                                                       'parsing.db')),
-                                         cursor=db_connection.cursor())
 
-    def parse_url(inner_url):
+    def init_worker():
+        worker_data.drivers = [create_silent_driver(page_load_strategy)] + [create_silent_driver() for _ in range(2)]
+        worker_data.storage = parser.StorageAdapterDataframe() if storage_type == 'df' \
+            else parser.StorageAdapterSQLite(db_connection,
+                                             cursor=db_connection.cursor(),
+                                             batch_size=batch_size,
+                                             schema=schema,
+                                             statements=statements,
+                                             seen_ids=seen_ids,
+                                             commit_state=commit_state,
+                                             lock=db_lock)
+        worker_data.df_dict = {}
+        workers.append((worker_data.drivers, worker_data.storage, worker_data.df_dict))
+
+    def parse_url(i, inner_url):
+        drivers, storage = worker_data.drivers, worker_data.storage
         try:
-            drivers[0].get(inner_url['url'])
-            print('{} in {}'.format(inner_url['index'], all_i))
-            bp = parser_name(drivers[0],
-                             storage=storage,
-                             fast=True,
-                             child_drivers=drivers[1:])
-            bp.parse_page()
-            if storage_type == 'df':
-                from_parser_to_dict(bp, df_dict)
+            drivers[0].get(inner_url)
+            wait(drivers[0], 15, poll_frequency=0.1).until(
+                ec.presence_of_element_located((By.XPATH, "//div[@class='row blockInfo']")))
+            print('{} in {}'.format(i, all_i))
+            page_storage = storage.create_child_storage()
+            with page_storage.transaction():
+                bp = parser_name(drivers[0],
+                                 storage=page_storage,
+                                 fast=True,
+                                 child_drivers=drivers[1:])
+                bp.parse_page()
+                if storage_type == 'df':
+                    from_parser_to_dict(bp, worker_data.df_dict)
+                else:
+                    page_storage.add_parsed_url(inner_url)
         except Exception as err:
             print(err)
             pass
 
-    urls.apply(parse_url, axis=1)
+    try:
+        with ThreadPoolExecutor(max_workers=settings.fetch_workers, initializer=init_worker) as executor:
+            list(executor.map(parse_url, range(all_i), urls['url']))
 
-    print("--- %s seconds ---" % (time.time() - start_time))
+        print("--- %s seconds ---" % (time.time() - start_time))
 
-    try:
         if storage_type == 'df':
+            for _, _, worker_dict in workers:
+                for label, all_df in worker_dict.items():
+                    df_dict.setdefault(label, []).extend(all_df)
+            df_dict = finalize_dict(df_dict)
             for one_element in df_dict.items():
-                one_element[1].to_csv(os.path.join(settings.output_directory,
+                one_element[1].to_csv(os.path.join(output_directory,
                                                    '{}.csv'.format(one_element[0])), sep=";", encoding='utf-8-sig')
         print("Finished.")
     except Exception as e:
         raise e
     finally:
-        storage.db_connection.close()
-        [driver.quit() for driver in drivers]
+        for drivers, storage, _ in workers:
+            storage.flush()
+            [driver.quit() for driver in drivers]
+        if db_connection is not None:
+            db_connection.close()
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import unittest
+
+import pandas as pd
+
+from parsing.parser import StorageAdapterSQLite
+
+
+class TestStorageAdapterSQLiteBatches(unittest.TestCase):
+    def setUp(self):
+        self.db_connection = sqlite3.connect(':memory:')
+        self.storage = StorageAdapterSQLite(self.db_connection, self.db_connection.cursor(), batch_size=5)
+
+    def tearDown(self):
+        self.db_connection.close()
+
+    def _parse_page(self, new_id):
+        """Write one page like parse_sites does, through a new child storage."""
+        child_storage = self.storage.create_child_storage()
+        with child_storage.transaction():
+            child_storage.set_identifiers(new_id, 'test')
+            child_storage.add_main_data('field', 'value')
+
+    def test_commit_after_batch_of_pages(self):
+        # Every page changes two rows, so the third page reaches the batch size.
+        self._parse_page(1)
+        self._parse_page(2)
+        self.assertTrue(self.db_connection.in_transaction)
+        self._parse_page(3)
+        self.assertFalse(self.db_connection.in_transaction)
+        self._parse_page(4)
+        self.assertTrue(self.db_connection.in_transaction)
+
+    def test_failed_page_is_rolled_back(self):
+        self._parse_page(1)
+        child_storage = self.storage.create_child_storage()
+        with self.assertRaises(RuntimeError):
+            with child_storage.transaction():
+                child_storage.set_identifiers(2, 'test')
+                raise RuntimeError('page is broken')
+        self._parse_page(3)
+        self.storage.flush()
+        ids = [row[0] for row in self.db_connection.execute("SELECT id FROM main_test ORDER BY id")]
+        self.assertEqual(ids, ['1', '3'])
+
+
+class TestStorageAdapterSQLiteSchema(unittest.TestCase):
+    def test_existing_child_tables_are_indexed(self):
+        db_connection = sqlite3.connect(':memory:')
+        db_connection.execute("CREATE TABLE main_test(id TEXT PRIMARY KEY)")
+        db_connection.execute("CREATE TABLE goods(id INTEGER PRIMARY KEY AUTOINCREMENT, parent_id TEXT, name TEXT)")
+        storage = StorageAdapterSQLite(db_connection, db_connection.cursor())
+        storage.set_identifiers(1, 'test')
+        indexes = {row[1] for row in db_connection.execute("SELECT type, name FROM sqlite_master WHERE type='index'")}
+        self.assertIn('ix_goods_parent_id', indexes)
+        self.assertNotIn('ix_main_test_parent_id', indexes)
+        db_connection.close()
+
+    def test_columns_differing_by_case_are_created_once(self):
+        db_connection = sqlite3.connect(':memory:')
+        storage = StorageAdapterSQLite(db_connection, db_connection.cursor())
+        storage.set_identifiers(1, 'test')
+        storage.add_table('goods', 1, pd.DataFrame([['a', 'b']], columns=['Name', 'Parent_ID']))
+        storage.add_table('goods', 2, pd.DataFrame([['c']], columns=['NAME']))
+        columns = [row[1] for row in db_connection.execute("PRAGMA table_info(goods)")]
+        self.assertEqual(columns, ['id', 'parent_id', 'Name'])
+        self.assertEqual(db_connection.execute("SELECT COUNT(*) FROM goods").fetchone()[0], 2)
+        db_connection.close()
+
+
+class TestStorageAdapterSQLiteThreads(unittest.TestCase):
+    def setUp(self):
+        self.db_connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.storage = StorageAdapterSQLite(self.db_connection, self.db_connection.cursor(), batch_size=5)
+
+    def tearDown(self):
+        self.db_connection.close()
+
+    def test_pages_are_parsed_in_parallel(self):
+        # Both threads have to be inside their page transactions at the same time to pass the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+        errors = []
+
+        def parse_page(new_id):
+            child_storage = self.storage.create_child_storage()
+            try:
+                with child_storage.transaction():
+                    child_storage.set_identifiers(new_id, 'test')
+                    barrier.wait()
+                    child_storage.add_main_data('field', 'value')
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=parse_page, args=(new_id,)) for new_id in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.storage.flush()
+        self.assertEqual(errors, [])
+        rows = list(self.db_connection.execute("SELECT id, field FROM main_test ORDER BY id"))
+        self.assertEqual(rows, [('1', 'value'), ('2', 'value')])
+
+
+if __name__ == '__main__':
+    unittest.main()